@@ -1,15 +1,32 @@
-#!python3
+#!/usr/bin/env python3
 
-from typing import List, Tuple, Any, Generator, Set, Dict
+from typing import List, Tuple, Any, Set, Dict, Optional, Deque, Callable, Final
 from pathlib import Path
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, as_completed
+import filecmp
+import fnmatch
+import functools
+import hashlib
+import io
+import json
 import shutil
+import stat
 import os
 import sys
+import time
 import yaml
 import argparse
 import re
+import shlex
 import subprocess
 
+# libyaml's parser is much faster than the pure Python one, but isn't available in every install
+try:
+    from yaml import CSafeLoader as YamlLoader
+except ImportError:
+    from yaml import SafeLoader as YamlLoader  # type: ignore
+
 
 class Config:
     """
@@ -20,6 +37,28 @@ class Config:
     COMPILER_FLAGS: str
     LINKER_FLAGS: str
 
+    # Compiler command and flags split into arguments, for running without a shell
+    COMPILER_ARGV: List[str]
+    COMPILER_FLAGS_ARGV: List[str]
+    LINKER_FLAGS_ARGV: List[str]
+
+    # SOURCE_DIR, HEADER_DIR and OBJECT_DIR normalised into prefixes for string path conversions
+    SOURCE_PREFIX: str
+    HEADER_PREFIX: str
+    OBJECT_PREFIX: str
+
+    # Program that compile commands are launched through, such as ccache. Empty if there isn't one
+    COMPILE_LAUNCHER: List[str]
+    # Environment variables added for compile commands only, such as CCACHE_PREFIX
+    COMPILE_ENV: Dict[str, str]
+    # Linker passed to the compiler with -fuse-ld when linking, such as lld. Empty to use the compiler's default
+    FAST_LINKER: str
+
+    # Leading arguments of dependency scanning, compiling and linking commands
+    DEPENDENCY_ARGV: List[str]
+    COMPILE_ARGV: List[str]
+    LINK_ARGV: List[str]
+
     EXE_DIR: str
     EXE_FILE: str
 
@@ -33,8 +72,9 @@ class Config:
     OBJECT_DIR: str
     OBJECT_EXT: str
 
-    OTHER_INCLUDE_PATHS: str
-    OTHER_LIB_PATHS: str
+    # -I and -L arguments for the extra include and library paths
+    OTHER_INCLUDE_PATHS: List[str]
+    OTHER_LIB_PATHS: List[str]
 
     RESOURCES: Dict[Path, Path]
 
@@ -45,14 +85,34 @@ class Config:
     # Skips linking stage.
     SKIP_LINKER: bool
 
+    # Maximum number of compiler processes to run at once.
+    JOBS: int
+
+    # Compares file contents before rebuilding objects whose sources or headers only look newer.
+    HASH_CHECK: bool
+
+    # Links objects other than the main ones through a static archive.
+    ARCHIVE: bool
+
+    # Hands compiling and linking to ninja when set to "ninja".
+    BACKEND: str
+
+    # Finds dependencies by reading #include lines instead of running the compiler with -MM.
+    SCAN_INCLUDES: bool
+    # Folders searched for quoted includes after the including file's folder, in the compiler's order
+    INCLUDE_DIRS: List[str]
+
+    # Suffix of header files in -MM output, including the dot.
+    HEADER_SUFFIX: bytes
+
     @classmethod
     def construct(cls, configuration: Dict[str, Any]):
         """
         Sets the global configuration for this build. The README contains a description of the arguments.
         """
 
-        def _get_default(arg: str, default):
-            return configuration[arg] if arg in configuration else default
+        # Optional args are looked up with a single dict probe each
+        _get_default = configuration.get
 
         # required args
         Config.COMPILER = configuration["COMPILER"]
@@ -62,6 +122,10 @@ class Config:
         Config.COMPILER_FLAGS = _get_default("COMPILER_FLAGS", "")
         Config.LINKER_FLAGS = _get_default("LINKER_FLAGS", "")
 
+        Config.COMPILER_ARGV = shlex.split(Config.COMPILER)
+        Config.COMPILER_FLAGS_ARGV = shlex.split(Config.COMPILER_FLAGS)
+        Config.LINKER_FLAGS_ARGV = shlex.split(Config.LINKER_FLAGS)
+
         Config.SOURCE_DIR = _get_default("SOURCE_DIR", "src/")
         Config.SOURCE_EXT = _get_default("SOURCE_EXT", "cpp")
 
@@ -71,14 +135,58 @@ class Config:
         Config.OBJECT_DIR = _get_default("OBJECT_DIR", "build/")
         Config.OBJECT_EXT = _get_default("OBJECT_EXT", "o")
 
+        def _dir_prefix(directory: str) -> str:
+            normalised = str(Path(directory))
+            return "" if normalised == "." else normalised + os.sep
+
+        Config.SOURCE_PREFIX = _dir_prefix(Config.SOURCE_DIR)
+        Config.HEADER_PREFIX = _dir_prefix(Config.HEADER_DIR)
+        Config.OBJECT_PREFIX = _dir_prefix(Config.OBJECT_DIR)
+
         Config.EXE_DIR = _get_default("EXE_DIR", "bin/")
         Config.EXE_FILE = _get_default("EXE_FILE", "a.out")
 
-        Config.OTHER_INCLUDE_PATHS = _get_default("OTHER_INCLUDE_PATHS", [])
-        Config.OTHER_INCLUDE_PATHS = " ".join(["-I" + p for p in Config.OTHER_INCLUDE_PATHS])
-
-        Config.OTHER_LIB_PATHS = _get_default("OTHER_LIB_PATHS", [])
-        Config.OTHER_LIB_PATHS = " ".join(["-L" + p for p in Config.OTHER_LIB_PATHS])
+        Config.OTHER_INCLUDE_PATHS = ["-I" + p for p in _get_default("OTHER_INCLUDE_PATHS", [])]
+        Config.OTHER_LIB_PATHS = ["-L" + p for p in _get_default("OTHER_LIB_PATHS", [])]
+
+        # When CCACHE is true, ccache, or sccache if ccache isn't installed, is used for compiling. A string names a different
+        # executable. Setting USE_CCACHE=0 in the environment turns off the lookup for a single run. A COMPILER that already starts
+        # with a launcher isn't wrapped in another one
+        ccache = _get_default("CCACHE", False)
+        if ccache is True:
+            ccache = None if os.environ.get("USE_CCACHE") == "0" else shutil.which("ccache") or shutil.which("sccache")
+        has_launcher = os.path.basename(Config.COMPILER_ARGV[0]) in ("ccache", "sccache", "distcc")
+        Config.COMPILE_LAUNCHER = shlex.split(ccache) if ccache and not has_launcher else []
+        Config.COMPILE_ENV = {}
+
+        # Compiles are distributed with distcc when it's installed and DISTCC_HOSTS names machines to send them to, unless DISTCC
+        # is false. Behind ccache, distcc only runs on cache misses. sccache can't run other launchers, and distributes compiles
+        # itself when configured to, so distcc isn't used with it
+        distcc = _get_default("DISTCC", True)
+        if distcc is True:
+            distcc = shutil.which("distcc") if os.environ.get("DISTCC_HOSTS") else None
+        if distcc and not has_launcher:
+            if not Config.COMPILE_LAUNCHER:
+                Config.COMPILE_LAUNCHER = shlex.split(distcc)
+            elif os.path.basename(Config.COMPILE_LAUNCHER[0]).startswith("ccache"):
+                Config.COMPILE_ENV["CCACHE_PREFIX"] = os.environ.get("CCACHE_PREFIX", distcc)
+
+        # Everything but the file arguments is the same for every command of each kind, so those parts are only built once
+        Config.DEPENDENCY_ARGV = [*Config.COMPILER_ARGV, *Config.OTHER_INCLUDE_PATHS, "-MM", f"-I{Config.HEADER_DIR}"]
+        # -pipe passes the output of each compiler stage straight to the next instead of through temporary files
+        Config.COMPILE_ARGV = [*Config.COMPILE_LAUNCHER, *Config.COMPILER_ARGV, "-fdiagnostics-color=always", "-pipe",
+                               *Config.COMPILER_FLAGS_ARGV, "-c", "-MMD", f"-I{Config.HEADER_DIR}", *Config.OTHER_INCLUDE_PATHS]
+        # When LINKER is true, lld is used if it's installed, or gold otherwise. A string names the linker, and linker flags that
+        # already choose one take precedence
+        linker = _get_default("LINKER", False)
+        if linker is True:
+            linker = next((name for name in ("lld", "gold") if shutil.which("ld." + name)), None)
+        if any(flag.startswith("-fuse-ld=") for flag in Config.LINKER_FLAGS_ARGV):
+            linker = None
+        Config.FAST_LINKER = linker or ""
+        use_linker = [f"-fuse-ld={Config.FAST_LINKER}"] if Config.FAST_LINKER else []
+
+        Config.LINK_ARGV = [*Config.COMPILER_ARGV, *use_linker, *Config.OTHER_LIB_PATHS, *Config.LINKER_FLAGS_ARGV]
 
         if "RESOURCES" in configuration:
             Config.RESOURCES = {Path(in_file): Path(out_file) for in_file, out_file in configuration["RESOURCES"].items()}
@@ -94,194 +202,1182 @@ class Config:
 
         Config.SKIP_LINKER = _get_default("SKIP_LINKER", False)
 
+        Config.ARCHIVE = _get_default("ARCHIVE", False)
+        Config.BACKEND = _get_default("BACKEND", "python")
+        Config.HASH_CHECK = _get_default("HASH_CHECK", False)
+        Config.SCAN_INCLUDES = _get_default("SCAN_INCLUDES", False)
+        Config.INCLUDE_DIRS = [Config.HEADER_DIR, *_get_default("OTHER_INCLUDE_PATHS", [])]
 
-class Colour:
-    """ Wraps ANSI colour codes in an object for type-checking """
-    def __init__(self, val):
-        self.val = val
-
+        Config.JOBS = _get_default("JOBS", os.cpu_count() or 1)
+        # bool is a subclass of int, so true would otherwise be taken as 1
+        if isinstance(Config.JOBS, bool) or not isinstance(Config.JOBS, int) or Config.JOBS < 1:
+            # Starts on a new line, since parse_config leaves its progress message unterminated
+            colour_print(f"\nJOBS must be a whole number of at least 1, got '{Config.JOBS}'. Aborting.", colour=Colours.RED,
+                         style=Styles.BLD)
+            sys.exit(1)
 
-class Style:
-    """ Wraps ANSI style codes in an object for type-checking """
-    def __init__(self, val):
-        self.val = val
+        Config.HEADER_SUFFIX = b"." + Config.HEADER_EXT.encode()
 
 
 class Colours:
     """ ANSI code colour constants """
-    NIL = Colour('')          # No change
-    BLK = Colour('\033[90m')  # Black
-    RED = Colour('\033[91m')  # Red
-    GRN = Colour('\033[92m')  # Green
-    YLW = Colour('\033[93m')  # Yellow
-    BLU = Colour('\033[94m')  # Blue
-    MGT = Colour('\033[95m')  # Magenta
-    CYN = Colour('\033[96m')  # Cyan
-    WHT = Colour('\033[97m')  # White
+    NIL: Final[str] = ''          # No change
+    BLK: Final[str] = '\033[90m'  # Black
+    RED: Final[str] = '\033[91m'  # Red
+    GRN: Final[str] = '\033[92m'  # Green
+    YLW: Final[str] = '\033[93m'  # Yellow
+    BLU: Final[str] = '\033[94m'  # Blue
+    MGT: Final[str] = '\033[95m'  # Magenta
+    CYN: Final[str] = '\033[96m'  # Cyan
+    WHT: Final[str] = '\033[97m'  # White
 
 
 class Styles:
     """ ANSI code style constants """
-    NIL = Style('')         # No change
-    END = Style('\033[0m')  # Remove all changes (including color)
-    BLD = Style('\033[1m')  # Bold
-    ULN = Style('\033[4m')  # Underlined
-    ALL = Style('\033[1m\033[4m')  # Bold+underlined
+    NIL: Final[str] = ''         # No change
+    END: Final[str] = '\033[0m'  # Remove all changes (including color)
+    BLD: Final[str] = '\033[1m'  # Bold
+    ULN: Final[str] = '\033[4m'  # Underlined
+    ALL: Final[str] = '\033[1m\033[4m'  # Bold+underlined
+
+
+# ANSI codes are only written to terminals, and never when the NO_COLOR environment variable is set (see https://no-color.org)
+USE_COLOUR: Final[bool] = sys.stdout.isatty() and not os.environ.get("NO_COLOR")
+
+# Start and end of the line printed for each up to date object, formatted once rather than through colour_print for every object
+SKIP_PREFIX: Final[str] = (Colours.GRN if USE_COLOUR else "") + "Skipping (up to date):                "
+LINE_END: Final[str] = (Styles.END if USE_COLOUR else "") + "\n"
+
+# Matches ANSI escape sequences in command output
+ANSI_REGEX = re.compile(r"\x1b\[[0-9;]*[A-Za-z]")
 
 
 def colour_print(message: str,
-                 colour: Colour = Colours.NIL,
-                 style: Style = Styles.NIL,
+                 colour: str = Colours.NIL,
+                 style: str = Styles.NIL,
                  reset: bool = True,
                  **kwargs) -> None:
     """
     Prints a message with the given colour and style, if your shell supports ANSI codes
     """
-    reset_color = Styles.END.val if reset else ''
-    print(f"{colour.val}{style.val}{message}{reset_color}", **kwargs)
+    if not USE_COLOUR:
+        print(message, **kwargs)
+        return
+
+    reset_color = Styles.END if reset else ''
+    if not colour and not style:
+        # Nothing to prefix, so the message is printed without formatting a new string
+        print(message, end=reset_color + kwargs.pop("end", "\n"), **kwargs)
+    else:
+        print(f"{colour}{style}{message}{reset_color}", **kwargs)
 
 
 def merge_compilation_database():
     """
-    Merges compilation commands into one compilation database
+    Merges compilation commands into one compilation database. Each entry is written out as it's read rather than joined into one
+    string. The build script's own files in the object directory start with a dot and are skipped
+    """
+    with os.scandir(Config.OBJECT_DIR) as entries:
+        json_paths = [entry.path for entry in entries if entry.name.endswith(".json") and not entry.name.startswith(".")]
+
+    with open('compile_commands.json', 'wb') as output_file:
+        output_file.write(b"[\n")
+        # Every entry ends with a comma, which has to be removed from the last one, so each is held until the next is read
+        previous = b""
+        for json_path in json_paths:
+            output_file.write(previous)
+            with open(json_path, 'rb') as json_file:
+                previous = json_file.read()
+
+        comma_idx = previous.rfind(b",")
+        output_file.write(previous[:comma_idx] + previous[comma_idx+1:] + b"\n]")
+
+
+def find_outdated_copies(source: Path, dest: Path, copies: List[Tuple[str, str, int]], announce: bool = True,
+                         seen: Optional[Set[str]] = None) -> None:
+    """
+    Compares all files in source directory and checks if they are newer than the same files in the destination. Each file that is
+    missing or outdated in the destination is added to copies along with its mtime, and missing destination folders are created.
+    If seen is given, every source path and destination file that was checked is added to it.
+    """
+    # Folders are walked with an explicit stack of (source, destination, source stat, announce) using plain string paths. The stat
+    # of each entry comes from scandir, so it's only None for the initial source
+    stack: List[Tuple[str, str, Optional[os.stat_result], bool]] = [(str(source), str(dest), file_stat(source), announce)]
+    while stack:
+        (source_path, dest_path, source_stat, announce) = stack.pop()
+        if seen is not None:
+            seen.add(source_path)
+        if source_stat is None:
+            continue
+
+        if stat.S_ISDIR(source_stat.st_mode):
+            if file_stat(dest_path) is None:
+                if announce:
+                    colour_print(f"    Copying folder {source_path} to {dest_path}...", colour=Colours.YLW)
+                # The folder message covers every file inside it
+                announce = False
+                os.makedirs(dest_path, exist_ok=True)
+            with os.scandir(source_path) as entries:
+                for entry in entries:
+                    # Symlinks are followed, so a dangling one has no stat and is skipped, like any other missing source
+                    try:
+                        entry_stat = entry.stat()
+                    except OSError:
+                        continue
+                    stack.append((entry.path, os.path.join(dest_path, entry.name), entry_stat, announce))
+        else:
+            if seen is not None:
+                seen.add(dest_path)
+            dest_mtime = file_mtime(dest_path)
+            if dest_mtime is None or source_stat.st_mtime_ns > dest_mtime:
+                if announce:
+                    colour_print(f"    Copying file {source_path} to {dest_path}...", colour=Colours.YLW)
+                copies.append((source_path, dest_path, source_stat.st_mtime_ns))
+
+
+def same_contents(source: str, dest: str) -> bool:
+    """
+    Checks whether two files hold the same bytes. Files of different sizes are told apart without being read
+    """
+    try:
+        return filecmp.cmp(source, dest, shallow=False)
+    except OSError:
+        return False
+
+
+def copy_file(source: str, dest: str, mtime: int) -> None:
+    """
+    Copies a single file's contents, creating the destination folder if needed. The mode and mtime are carried over from the
+    source, so executable resources stay executable and the outdated check sees the source's mtime. If the destination already
+    has the same contents, only its mode and mtime are updated, so anything watching the destination doesn't see a rewrite
+    """
+    if not same_contents(source, dest):
+        os.makedirs(os.path.dirname(dest) or ".", exist_ok=True)
+        shutil.copyfile(source, dest)
+    shutil.copymode(source, dest)
+    os.utime(dest, ns=(mtime, mtime))
+
+
+# File arguments are passed through a response file once they add up to more characters than this, which keeps commands well
+# under the command line length limits of Linux (128 KiB for a single argument list) and Windows (32 KiB)
+RESPONSE_FILE_THRESHOLD = 8192
+
+
+def response_file_args(files: List[str], response_path: str) -> List[str]:
+    """
+    Returns the file arguments of a command as they are, or if they're long enough to risk going over the command line length
+    limit, writes them to a response file and returns the @file argument that reads it instead. Compilers, linkers and ar all
+    expand @file arguments
     """
-    result = ""
-    for json_path in Path(Config.OBJECT_DIR).glob("*.json"):
-        with open(json_path, 'r') as json_file:
-            result += json_file.read()
+    if sum(len(file) + 1 for file in files) <= RESPONSE_FILE_THRESHOLD:
+        return files
 
-    comma_idx = result.rfind(",")
-    result = "[\n" + result[:comma_idx] + result[comma_idx+1:] + "\n]"
+    os.makedirs(os.path.dirname(response_path) or ".", exist_ok=True)
+    with open(response_path, 'w') as response_file:
+        # Each file is quoted, and backslashes and quotes within it are escaped, as the response file parser expects
+        response_file.write("\n".join('"' + file.replace("\\", "\\\\").replace('"', '\\"') + '"' for file in files) + "\n")
+    return ["@" + response_path]
 
-    with open('compile_commands.json', 'w') as output_file:
-        output_file.write(result)
+
+def remove_response_file(response_path: str) -> None:
+    """
+    Deletes a response file written by response_file_args once its command has run. Does nothing if the arguments were short
+    enough to be passed directly
+    """
+    try:
+        os.remove(response_path)
+    except FileNotFoundError:
+        pass
 
 
-def copy_if_outdated(source: Path, dest: Path, depth: int = 0) -> None:
+def remove_tree(root: str) -> None:
     """
-    Compares all files in source directory and checks if they are newer than the same files in the destination. If they are, they
-    are copied to the destination.
+    Deletes a folder and everything in it. Files are unlinked in parallel once the whole tree has been listed, then the folders are
+    removed deepest first. Raises FileNotFoundError if the folder doesn't exist
     """
+    files: List[str] = []
+    folders: List[str] = [root]
+    stack = [root]
+    while stack:
+        with os.scandir(stack.pop()) as entries:
+            for entry in entries:
+                # Symlinks to folders are removed as links, rather than followed
+                if entry.is_dir(follow_symlinks=False):
+                    folders.append(entry.path)
+                    stack.append(entry.path)
+                else:
+                    files.append(entry.path)
+
+    with ThreadPoolExecutor(max_workers=Config.JOBS) as executor:
+        for _ in executor.map(os.unlink, files):
+            pass
+
+    # Every folder is listed after its parent, so going backwards removes children first
+    for folder in reversed(folders):
+        os.rmdir(folder)
 
-    if not source.exists():
+
+def discard_tree(root: str) -> None:
+    """
+    Moves a folder out of the way so the path is free straight away, and deletes it from a background process that outlives this
+    one. Folders left behind by earlier runs that were interrupted are deleted along with it. If the folder can't be moved or the
+    process can't be started, it's deleted here instead. A symlink is removed as a link, leaving the folder it points to alone.
+    Raises FileNotFoundError if the folder doesn't exist
+    """
+    root = os.path.normpath(root)
+    if os.path.islink(root):
+        os.unlink(root)
         return
 
-    if not dest.exists():
-        if source.is_dir():
-            colour_print(f"    Copying folder {str(source)} to {str(dest)}...", colour=Colours.YLW)
-            shutil.copytree(str(source), str(dest))
-        else:
-            colour_print(f"    Copying file {str(source)} to {str(dest)}...", colour=Colours.YLW)
-            shutil.copy2(str(source), str(dest))
-    else:
-        if source.is_file() and source.stat().st_mtime > dest.stat().st_mtime:
-            colour_print(f"    Copying file {str(source)} to {str(dest)}...", colour=Colours.YLW)
-            shutil.copy2(str(source), str(dest))
-        else:
-            for f in source.glob("*"):
-                copy_if_outdated(f, dest.joinpath(f.name), depth+1)
+    (parent, name) = os.path.split(root)
+    trash_name = f"{name}.trash.{os.getpid()}"
+    try:
+        os.rename(root, os.path.join(parent, trash_name))
+    except FileNotFoundError:
+        raise
+    except OSError:
+        remove_tree(root)
+        return
+
+    # Only folders named the way this function names them are swept, so nothing else next to the folder is touched
+    trash_regex = re.compile(re.escape(name) + r"\.trash\.\d+")
+    with os.scandir(parent or ".") as entries:
+        trash = [entry.path for entry in entries if trash_regex.fullmatch(entry.name) and entry.is_dir(follow_symlinks=False)]
+    try:
+        subprocess.Popen([sys.executable, "-c", "import shutil, sys\nfor path in sys.argv[1:]: shutil.rmtree(path, ignore_errors=True)",
+                          *trash], stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+                         start_new_session=True)
+    except OSError:
+        for path in trash:
+            remove_tree(path)
 
 
-def shell(cmd: str, stdout=subprocess.PIPE) -> subprocess.CompletedProcess:
+def run(argv: List[str], stderr=subprocess.STDOUT, env: Optional[Dict[str, str]] = None) -> subprocess.CompletedProcess:
     """
-    Executes a command on the shell using Popen and returns the object created
+    Executes a command directly (without a shell) and returns the completed process with its output captured. Variables in env are
+    added to this process's environment for the command. A missing executable is reported the same way a shell would, rather
+    than raising
     """
-    return subprocess.run(cmd, shell=True, stdin=subprocess.PIPE, stdout=stdout, stderr=subprocess.STDOUT)
+    try:
+        return subprocess.run(argv, stdout=subprocess.PIPE, stderr=stderr, check=False,
+                              env={**os.environ, **env} if env else None)
+    except FileNotFoundError:
+        return subprocess.CompletedProcess(argv, 127, stdout=f"{argv[0]}: command not found\n".encode())
+
+
+# Matches the wildcard characters understood by glob patterns
+GLOB_MAGIC_REGEX = re.compile(r"[*?[]")
 
 
-def test_source(source: Path, dependencies: List[Path]) -> bool:
+def match_paths(pattern: Path) -> List[Path]:
     """
-    Checks to see if source file needs to be built
+    Finds the paths matching a glob pattern. Patterns without wildcards take a single stat, and patterns with wildcards only in
+    the final part take a single scandir of their folder. Anything else, such as "**", falls back to Path.glob
     """
+    if not GLOB_MAGIC_REGEX.search(str(pattern)):
+        return [pattern] if file_stat(pattern) is not None else []
 
-    # constructs object file name from source file name
-    object_file = source_to_object(source)
+    if GLOB_MAGIC_REGEX.search(str(pattern.parent)):
+        return list(Path(".").glob(str(pattern)))
 
-    build_required = False
-    source_mtime = source.stat().st_mtime
+    try:
+        with os.scandir(pattern.parent) as entries:
+            return [Path(entry.path) for entry in entries if fnmatch.fnmatch(entry.name, pattern.name)]
+    except OSError:
+        return []
+
+
+def indent_output(data: bytes) -> str:
+    """
+    Decodes the output of a command in one pass and indents each line with a tab. Produces an empty string if there was no output.
+    Compilers are always asked for coloured diagnostics, so the colours are removed here when they aren't wanted
+    """
+    text = data.decode(sys.stdout.encoding, errors="replace").rstrip("\n")
+    if not USE_COLOUR:
+        text = ANSI_REGEX.sub("", text)
+    return "\t" + text.replace("\n", "\n\t") + "\n" if text else ""
 
-    if os.path.exists(object_file):
-        object_mtime = object_file.stat().st_mtime
-        if object_mtime < source_mtime:
-            # Source is newer than object file, compile
-            build_required = True
-        else:
-            # Check if any dependencies are newer than object file
-            for dep in dependencies:
-                if object_mtime < dep.stat().st_mtime:
-                    # Dependency is newer than object file, compile
-                    build_required = True
-                    break
-    else:
-        # Object file hasn't been made, we need to compile
-        build_required = True
 
-    return build_required
+@functools.lru_cache(maxsize=None)
+def _file_stat(path: str) -> Optional[os.stat_result]:
+    try:
+        return os.stat(path)
+    except OSError:
+        return None
 
 
-def source_files() -> List[Tuple[Path, bool]]:
+def file_stat(path: Any) -> Optional[os.stat_result]:
     """
-    Creates a generator of all files in the project with the source extension set in the config, and determines if they need building
+    Returns the stat result of a file, or None if it doesn't exist. Cached for the duration of a build, since shared headers are
+    checked for many sources. Paths are cached by their string form, so a Path and a string for the same file share an entry
     """
-    checked_deps: Set[Path] = set()
-    deps: Set[Path] = set()
-    sources: List[Tuple[Path, bool]] = []
+    return _file_stat(os.fspath(path))
 
-    for init_source_path in Path(Config.SOURCE_DIR).joinpath(Config.SOURCE_MAIN).parent.glob(Path(Config.SOURCE_MAIN).name):
-        new_deps = list(generate_dependencies(init_source_path))
-        sources.append((init_source_path, test_source(init_source_path, new_deps)))
-        deps.update(new_deps)
 
-    while deps:
-        current_dep = deps.pop()
-        if current_dep in checked_deps:
-            continue
+def file_mtime(path: Any) -> Optional[int]:
+    """
+    Returns the modification time of a file in nanoseconds, or None if it doesn't exist, using the cached stat result. Integer
+    nanoseconds compare exactly, unlike float seconds, and survive a round trip through JSON unchanged
+    """
+    stat_result = _file_stat(os.fspath(path))
+    return None if stat_result is None else stat_result.st_mtime_ns
 
-        checked_deps.add(current_dep)
 
-        # If this header has specified source files, use the mapping
-        if current_dep in Config.DEPEND_MAPPING:
-            for current_source in Config.DEPEND_MAPPING[current_dep]:
-                if os.path.exists(current_source):
-                    new_deps = list(generate_dependencies(current_source))
-                    sources.append((current_source, test_source(current_source, list(new_deps))))
-                    deps.update(new_deps)
-        else:
-            # Otherwise assume there is a file with the same name and path as the header
-            current_source = header_to_source(current_dep)
+def test_source_self(source: str) -> bool:
+    """
+    Checks to see if source file needs to be built because of the source itself, without looking at its dependencies. Takes a
+    normalised path string
+    """
+    # Object file hasn't been made, we need to compile
+    object_stat = _file_stat(source_to_object_str(source))
+    if object_stat is None:
+        return True
+
+    # Source is newer than object file, compile unless its content is the same as when the object was built
+    source_stat = _file_stat(source)
+    if source_stat is None or object_stat.st_mtime_ns < source_stat.st_mtime_ns:
+        return not (Config.HASH_CHECK and recorded_content_matches(source, [source]))
+
+    return False
+
+
+def test_source_deps(source: str, dependencies: List[str]) -> bool:
+    """
+    Checks to see if source file needs to be built because any of its dependencies are newer than its object file (or have been
+    removed). Takes normalised path strings
+    """
+    object_stat = _file_stat(source_to_object_str(source))
+    if object_stat is None:
+        return True
+    object_mtime = object_stat.st_mtime_ns
+
+    for dep in dependencies:
+        dep_stat = _file_stat(dep)
+        if dep_stat is None or object_mtime < dep_stat.st_mtime_ns:
+            # Unless the object was built from exactly these files with the same contents
+            all_files = [source, *dependencies]
+            return not (Config.HASH_CHECK and set(_build_hashes.get(source, ())) == set(all_files)
+                        and recorded_content_matches(source, all_files))
 
-            if os.path.exists(current_source):
-                new_deps = list(generate_dependencies(current_source))
-                sources.append((current_source, test_source(current_source, list(new_deps))))
-                deps.update(new_deps)
+    return False
 
-    return sources
+
+def test_source(source: str, dependencies: List[str]) -> bool:
+    """
+    Checks to see if source file needs to be built. Takes normalised path strings
+    """
+    return test_source_self(source) or test_source_deps(source, dependencies)
 
 
-def header_to_source(header: Path) -> Path:
+def source_files(missing_sources: Optional[Set[Path]] = None,
+                 on_outdated: Optional[Callable[[Path], None]] = None) -> List[Tuple[Path, bool, int]]:
     """
-    Takes in a path to a header file and produces a path to where a corresponding source file should be
+    Creates a list of all files in the project with the source extension set in the config, and determines if they need building.
+    Each source is paired with the number of other sources that include the header it provides, which is used as a scheduling hint.
+    Sources are discovered in waves, and the dependencies of every source in a wave are generated with one compiler command.
+    Sources are only checked for building once discovery is finished.
+    If missing_sources is given, the paths of sources which would have been built if they existed are added to it.
+    If on_outdated is given, it's called as soon as a source is found to be newer than its object, so that it can start building
+    while the rest of the sources are discovered. Those sources are still returned as needing building.
     """
-    return Path(Config.SOURCE_DIR).joinpath(Path(header).relative_to(Config.HEADER_DIR).parent, f"{Path(header).stem}.{Config.SOURCE_EXT}")
+    # Headers that have been queued for checking. Filtering on insertion keeps duplicates out of the worklist
+    seen_deps: Set[Path] = set()
+    deps: Deque[Path] = deque()
+    # Each source is stored with the header that led to its discovery, or None for the initial sources
+    seen_sources: Set[Path] = set()
+    sources: List[Tuple[Path, Any]] = []
+    # Number of sources which include each header
+    include_counts: Dict[Path, int] = {}
+
+    # Sources discovered but not yet scanned for dependencies
+    pending: List[Tuple[Path, Any]] = []
+    # Sources already passed to on_outdated
+    outdated_early: Set[Path] = set()
+
+    def _queue_source(source: Path, header: Any):
+        if source in seen_sources:
+            return
+        seen_sources.add(source)
+        if file_mtime(source) is not None:
+            pending.append((source, header))
+            if on_outdated is not None and test_source_self(str(source)):
+                outdated_early.add(source)
+                on_outdated(source)
+        elif missing_sources is not None:
+            missing_sources.add(source)
+
+    for init_source_path in match_paths(Path(Config.SOURCE_DIR).joinpath(Config.SOURCE_MAIN)):
+        _queue_source(init_source_path, None)
+
+    # Dependencies of every reached source, filled in by the discovery phase
+    dependency_map: Dict[Path, List[Path]] = {}
+    # Looked up once for every header, so it's kept in a local rather than read from Config each time
+    depend_mapping = Config.DEPEND_MAPPING
+
+    while pending:
+        dependency_map.update(generate_all_dependencies([source for (source, _) in pending]))
+        for (source, header) in pending:
+            new_deps = dependency_map[source]
+            sources.append((source, header))
+            for dep in new_deps:
+                include_counts[dep] = include_counts.get(dep, 0) + 1
+                if dep not in seen_deps:
+                    seen_deps.add(dep)
+                    deps.append(dep)
+        pending = []
+
+        while deps:
+            current_dep = deps.popleft()
+
+            # If this header has specified source files, use the mapping
+            if (mapped_sources := depend_mapping.get(current_dep)) is not None:
+                for current_source in mapped_sources:
+                    _queue_source(current_source, current_dep)
+            else:
+                # Otherwise assume there is a file with the same name and path as the header
+                if (current_source := header_to_source_str(str(current_dep))) is not None:
+                    _queue_source(Path(current_source), current_dep)
+
+    # Every source is known at this point, so checking them is only stat lookups
+    return [(source,
+             source in outdated_early or str(source) in _unscanned_sources
+             or test_source(str(source), [str(dep) for dep in dependency_map[source]]),
+             include_counts.get(header, 0))
+            for (source, header) in sources]
+
+
+def _strip_dir_prefix(path: str, prefix: str) -> Optional[str]:
+    """
+    Takes a normalised path and a directory prefix from the config, and produces the path relative to that directory without its
+    extension. Returns None if the path isn't inside the directory
+    """
+    if not path.startswith(prefix):
+        return None
+    return os.path.splitext(path[len(prefix):])[0]
+
+
+@functools.lru_cache(maxsize=None)
+def header_to_source_str(header: str) -> Optional[str]:
+    """
+    Takes in a path to a header file and produces a path to where a corresponding source file should be. Headers outside of the
+    header directory have no corresponding source, and produce None. Takes a normalised path, as produced by str(Path(...)).
+    Memoised, since common headers are mapped once for every source that includes them
+    """
+    stem = _strip_dir_prefix(header, Config.HEADER_PREFIX)
+    return None if stem is None else f"{Config.SOURCE_PREFIX}{stem}.{Config.SOURCE_EXT}"
+
+
+@functools.lru_cache(maxsize=None)
+def source_to_object_str(source: str) -> str:
+    """
+    String version of source_to_object for hot paths. Takes a normalised path, as produced by str(Path(...)). Memoised, since
+    each source is mapped several times while checking and linking it
+    """
+    stem = _strip_dir_prefix(source, Config.SOURCE_PREFIX)
+    if stem is None:
+        raise ValueError(f"{source} is not in the source directory {Config.SOURCE_DIR}")
+    return f"{Config.OBJECT_PREFIX}{stem}.{Config.OBJECT_EXT}"
 
 
 def source_to_object(source: Path) -> Path:
     """
     Takes in a path to a source file and produces a path to where a corresponding object file should be
     """
-    return Path(Config.OBJECT_DIR).joinpath(Path(source).relative_to(Config.SOURCE_DIR).parent, f"{Path(source).stem}.{Config.OBJECT_EXT}")
+    return Path(source_to_object_str(str(Path(source))))
+
+
+# Name of the file within the object directory that stores dependencies found by previous builds
+DEPENDENCY_CACHE_FILE = ".depcache.json"
+
+# Maps a file to its mtime and the mtimes of each of its dependencies at the time they were generated
+_dependency_cache: Dict[str, Dict[str, Any]] = {}
+
+# Sources whose dependencies couldn't be found during this build. Their dependency lists are unknown rather than empty, so they're
+# always built, which either reports the error or writes a dependency file to fill the cache from
+_unscanned_sources: Set[str] = set()
+
+
+def dependency_cache_key() -> str:
+    """
+    Produces a string identifying the settings that decide which dependencies are found, so that changing them discards the cache
+    """
+    return repr((Config.DEPENDENCY_ARGV, Config.COMPILER_FLAGS_ARGV, Config.HEADER_EXT, Config.SCAN_INCLUDES, Config.INCLUDE_DIRS))
+
+
+def load_dependency_cache() -> None:
+    """
+    Loads the dependencies generated by the previous build, if there was one and it used the same settings
+    """
+    _dependency_cache.clear()
+    try:
+        with open(Path(Config.OBJECT_DIR).joinpath(DEPENDENCY_CACHE_FILE), 'r') as cache_file:
+            cache = json.load(cache_file)
+        if cache.get("key") == dependency_cache_key():
+            _dependency_cache.update(cache["entries"])
+    except (OSError, ValueError, AttributeError, KeyError):
+        pass
+
+
+def save_dependency_cache() -> None:
+    """
+    Saves the dependencies generated during this build so the next build can reuse them
+    """
+    Path(Config.OBJECT_DIR).mkdir(parents=True, exist_ok=True)
+    # Written to a temporary file first so that an interrupted build can't leave a partial cache behind
+    cache_path = Path(Config.OBJECT_DIR).joinpath(DEPENDENCY_CACHE_FILE)
+    with open(cache_path.with_suffix(".tmp"), 'w') as cache_file:
+        json.dump({"key": dependency_cache_key(), "entries": _dependency_cache}, cache_file)
+    os.replace(cache_path.with_suffix(".tmp"), cache_path)
+
+
+# Name of the file within the object directory that stores the contents of the files each object was built from
+BUILD_HASHES_FILE = ".build_hashes.json"
+
+# Maps a source to the mtime and content hash of itself and each of its dependencies when its object was last built
+_build_hashes: Dict[str, Dict[str, List[Any]]] = {}
+
+
+def load_build_hashes() -> None:
+    """
+    Loads the content hashes recorded by previous builds, if there were any
+    """
+    _build_hashes.clear()
+    try:
+        with open(Path(Config.OBJECT_DIR).joinpath(BUILD_HASHES_FILE), 'r') as hashes_file:
+            _build_hashes.update(json.load(hashes_file))
+    except (OSError, ValueError):
+        pass
+
+
+def save_build_hashes() -> None:
+    """
+    Saves the content hashes recorded during this build
+    """
+    Path(Config.OBJECT_DIR).mkdir(parents=True, exist_ok=True)
+    with open(Path(Config.OBJECT_DIR).joinpath(BUILD_HASHES_FILE), 'w') as hashes_file:
+        json.dump(_build_hashes, hashes_file)
+
+
+@functools.lru_cache(maxsize=None)
+def file_digest(path: str) -> Optional[str]:
+    """
+    Returns a hash of a file's contents, or None if it can't be read. Cached for the duration of a build
+    """
+    try:
+        with open(path, 'rb') as hashed_file:
+            return hashlib.blake2b(hashed_file.read(), digest_size=16).hexdigest()
+    except OSError:
+        return None
+
+
+def recorded_content_matches(source: str, paths: List[str]) -> bool:
+    """
+    Checks whether each of the paths still has the content it had when the object of source was last built. Files whose mtime
+    hasn't changed since then aren't read, and files which are unchanged apart from their mtime have the new mtime recorded so they
+    aren't read again next time.
+    """
+    record = _build_hashes.get(source)
+    if record is None:
+        return False
+
+    for path in paths:
+        entry = record.get(path)
+        stat_result = _file_stat(path)
+        if entry is None or stat_result is None:
+            return False
+        if stat_result.st_mtime_ns != entry[0]:
+            if file_digest(path) != entry[1]:
+                return False
+            entry[0] = stat_result.st_mtime_ns
+
+    return True
+
+
+# File mtimes come from a coarser clock than time.time_ns(), so a file written just after a build starts can have an mtime slightly
+# before the recorded start. Files are compared against the start time less this much
+FILE_CLOCK_SLACK_NS = 10_000_000
+
+
+def record_content(source: Path, build_started: int) -> None:
+    """
+    Records the mtime and content hash of a source and its dependencies after its object has been built. Each file is stat'ed again
+    rather than read from the stat cache, and a file that changed since it was cached is hashed again. Nothing is recorded if the
+    source's dependencies aren't known, or if any of the files was modified after build_started, since the object may have been
+    compiled from the earlier contents. Either way the source is built again next time
+    """
+    entry = _dependency_cache.get(str(source))
+    if entry is None:
+        _build_hashes.pop(str(source), None)
+        return
+
+    record: Dict[str, List[Any]] = {}
+    for path in [str(source), *entry["deps"]]:
+        try:
+            mtime = os.stat(path).st_mtime_ns
+        except OSError:
+            record[path] = [None, None]
+            continue
+        if mtime >= build_started - FILE_CLOCK_SLACK_NS:
+            _build_hashes.pop(str(source), None)
+            return
+        record[path] = [mtime, file_digest(path) if mtime == file_mtime(path) else file_digest.__wrapped__(path)]
+    _build_hashes[str(source)] = record
+
+
+# Name of the file within the object directory that records the state of every file used by the last successful build
+MANIFEST_FILE = ".manifest.json"
+
+
+def config_fingerprint() -> str:
+    """
+    Produces a string identifying the parts of the configuration which decide what gets built and how
+    """
+    return repr((Config.COMPILE_ARGV, Config.DEPENDENCY_ARGV, Config.LINK_ARGV, Config.SOURCE_MAIN, Config.SOURCE_DIR,
+                 Config.SOURCE_EXT, Config.HEADER_DIR, Config.HEADER_EXT, Config.OBJECT_DIR, Config.OBJECT_EXT, Config.EXE_DIR,
+                 Config.EXE_FILE, sorted((str(h), [str(s) for s in srcs]) for h, srcs in Config.DEPEND_MAPPING.items()),
+                 Config.COMPILATION_DATABASE, Config.SKIP_LINKER, Config.SCAN_INCLUDES, Config.ARCHIVE, Config.HASH_CHECK))
+
+
+def manifest_up_to_date() -> Optional[List[str]]:
+    """
+    Compares the manifest written by the last successful build against the files it recorded. If the configuration is the same,
+    every recorded file has the same mtime and size, and every missing source is still missing, nothing needs to be scanned or
+    built, and the object files of that build are returned. Otherwise returns None
+    """
+    try:
+        with open(Path(Config.OBJECT_DIR).joinpath(MANIFEST_FILE), 'r') as manifest_file:
+            manifest = json.load(manifest_file)
+    except (OSError, ValueError):
+        return None
+
+    if manifest.get("config") != config_fingerprint():
+        return None
+
+    for path, (mtime, size) in manifest["files"].items():
+        stat_result = file_stat(Path(path))
+        if stat_result is None or stat_result.st_mtime_ns != mtime or stat_result.st_size != size:
+            return None
+
+    for path in manifest["missing"]:
+        if file_stat(Path(path)) is not None:
+            return None
+
+    return manifest["objects"]
+
+
+def remove_manifest() -> None:
+    """
+    Removes the manifest, since it no longer describes an up to date build
+    """
+    try:
+        os.remove(Path(Config.OBJECT_DIR).joinpath(MANIFEST_FILE))
+    except OSError:
+        pass
+
+
+def save_manifest(sources: List[Path], object_paths: List[str], missing_sources: Set[Path]) -> None:
+    """
+    Records the state of every file that went into this build. Sources and their dependencies are recorded as they were when they
+    were scanned, so a source changed partway through the build is still rebuilt next time. No manifest is written if the
+    dependencies of any source aren't known, since it couldn't tell when that source needs building again. Nor is one written if
+    SOURCE_MAIN has wildcards in its folders, since new main files could then appear in folders that aren't recorded
+    """
+    # New files matching SOURCE_MAIN change the mtime of the folder they're in
+    seed_dir = Path(Config.SOURCE_DIR).joinpath(Config.SOURCE_MAIN).parent
+    if GLOB_MAGIC_REGEX.search(str(seed_dir)):
+        return
+
+    files: Dict[str, Tuple[int, int]] = {}
+
+    def _record(path: str, stat_result: Optional[os.stat_result]):
+        if stat_result is not None:
+            files[path] = (stat_result.st_mtime_ns, stat_result.st_size)
+
+    _record(str(seed_dir), file_stat(seed_dir))
+
+    for source in sources:
+        if (entry := _dependency_cache.get(str(source))) is None:
+            return
+        _record(str(source), file_stat(source))
+        for dep in entry["deps"]:
+            _record(dep, file_stat(Path(dep)))
+
+    # Objects and the executable were written during this build, so their cached stats are out of date
+    for object_path in object_paths:
+        _record(object_path, os.stat(object_path))
+    if not Config.SKIP_LINKER:
+        exe_full_path = str(Path(Config.EXE_DIR).joinpath(Config.EXE_FILE))
+        _record(exe_full_path, os.stat(exe_full_path))
+
+    manifest = {
+        "config": config_fingerprint(),
+        "files": files,
+        "missing": [str(source) for source in missing_sources],
+        "objects": object_paths,
+    }
+
+    # Written to a temporary file first so that an interrupted build can't leave a partial manifest behind
+    manifest_path = Path(Config.OBJECT_DIR).joinpath(MANIFEST_FILE)
+    with open(manifest_path.with_suffix(".tmp"), 'w') as manifest_file:
+        json.dump(manifest, manifest_file)
+    os.replace(manifest_path.with_suffix(".tmp"), manifest_path)
+
+
+# Name of the file within the object directory that records the resource files checked by the last resource update
+RESOURCE_SNAPSHOT_FILE = ".resources.json"
+
+
+def load_resource_snapshot() -> Dict[str, Dict[str, Optional[int]]]:
+    """
+    Loads the mtimes of the resource files checked by the last resource update, grouped by resource entry
+    """
+    try:
+        with open(Path(Config.OBJECT_DIR).joinpath(RESOURCE_SNAPSHOT_FILE), 'r') as snapshot_file:
+            return json.load(snapshot_file)
+    except (OSError, ValueError):
+        return {}
+
+
+def save_resource_snapshot(snapshot: Dict[str, Dict[str, Optional[int]]]) -> None:
+    """
+    Saves the mtimes of the resource files checked by this resource update
+    """
+    Path(Config.OBJECT_DIR).mkdir(parents=True, exist_ok=True)
+    with open(Path(Config.OBJECT_DIR).joinpath(RESOURCE_SNAPSHOT_FILE), 'w') as snapshot_file:
+        json.dump(snapshot, snapshot_file)
+
+
+def resource_snapshot_matches(entry: Optional[Dict[str, Optional[int]]]) -> bool:
+    """
+    Checks whether every path recorded for a resource entry still has the same mtime, including paths recorded as missing
+    """
+    if entry is None:
+        return False
+    return all(file_mtime(path) == mtime for path, mtime in entry.items())
+
+
+# Matches preprocessor directives, along with any lines they're continued onto
+DIRECTIVE_REGEX = re.compile(rb"^[ \t]*#(?:[^\n]*\\\n)*[^\n]*", re.MULTILINE)
+
+# Matches comments, and string and character literals so that comment markers inside them are skipped over
+COMMENT_REGEX = re.compile(rb"//[^\n]*|/\*.*?\*/|\"(?:\\.|[^\"\\\n])*\"|'(?:\\.|[^'\\\n])*'", re.DOTALL)
+
+
+def _strip_comment(match: "re.Match[bytes]") -> bytes:
+    # A block comment becomes a single space like it does in the preprocessor, which joins the lines it spanned, so a directive
+    # following a comment on the same line isn't mistaken for one
+    text = match.group(0)
+    if text.startswith(b"//"):
+        return b""
+    if text.startswith(b"/*"):
+        return b" "
+    return text
+
+
+@functools.lru_cache(maxsize=None)
+def directive_digest(path: str) -> Optional[str]:
+    """
+    Returns a hash of the preprocessor directives in a file, or None if it can't be read. Which headers a file pulls in is decided
+    by directives alone, so edits elsewhere in the file don't change its dependencies. Comments are removed first, since commenting
+    a directive out or back in changes it. Cached for the duration of a build
+    """
+    try:
+        with open(path, 'rb') as directive_file:
+            text = COMMENT_REGEX.sub(_strip_comment, directive_file.read())
+        return hashlib.blake2b(b"\n".join(DIRECTIVE_REGEX.findall(text)), digest_size=8).hexdigest()
+    except OSError:
+        return None
+
+
+def dependency_cache_entry(file: Path, deps: List[Path]) -> Dict[str, Any]:
+    """
+    Produces the dependency cache entry of a file, which records the mtime and directives of the file and each of its dependencies
+    """
+    return {"mtime": file_mtime(file), "deps": {str(dep): file_mtime(dep) for dep in deps},
+            "directives": {path: directive_digest(path) for path in (str(file), *map(str, deps))}}
+
+
+def cached_dependencies(file: Path) -> Any:
+    """
+    Returns the cached dependencies of a file, or None if the file or any of its dependencies has changed since they were generated.
+    A file that has changed without any change to its preprocessor directives still has the same dependencies, so its new mtime is
+    recorded in the entry instead.
+    """
+    entry = _dependency_cache.get(str(file))
+    if entry is None:
+        return None
+    directives = entry.get("directives", {})
+
+    def _unchanged(path: str, mtime: Optional[int]) -> bool:
+        return file_mtime(path) == mtime or (directives.get(path) is not None and directive_digest(path) == directives[path])
+
+    if not _unchanged(str(file), entry["mtime"]):
+        return None
+    entry["mtime"] = file_mtime(file)
+    deps = entry["deps"]
+    for dep, dep_mtime in deps.items():
+        if not _unchanged(dep, dep_mtime):
+            return None
+        deps[dep] = file_mtime(dep)
+
+    return [Path(dep) for dep in deps]
+
+
+# Matches quoted #include directives. Angle bracket includes are treated as system headers, as -MM does
+INCLUDE_REGEX = re.compile(rb'^[ \t]*#[ \t]*include[ \t]*"([^"\n]+)"', re.MULTILINE)
+
+
+@functools.lru_cache(maxsize=None)
+def scan_includes(file: str) -> List[str]:
+    """
+    Reads the quoted #include lines of a file and resolves each against the file's own folder and then the include folders,
+    like the preprocessor does. Includes which can't be found are left out. Includes inside disabled #if blocks are still followed,
+    so this can find more dependencies than -MM, but never fewer unless includes are built with macros.
+    """
+    try:
+        with open(file, 'rb') as source_file:
+            names = INCLUDE_REGEX.findall(source_file.read())
+    except OSError:
+        return []
+
+    includes = []
+    search_dirs = [os.path.dirname(file), *Config.INCLUDE_DIRS]
+    for name in names:
+        for search_dir in search_dirs:
+            candidate = os.path.normpath(os.path.join(search_dir, os.fsdecode(name)))
+            if file_stat(candidate) is not None:
+                includes.append(candidate)
+                break
+    return includes
+
+
+def scan_dependencies(file: str) -> List[str]:
+    """
+    Finds every header a file includes directly or indirectly by scanning #include lines, in the order they're first reached
+    """
+    deps: List[str] = []
+    seen: Set[str] = {file}
+    stack = list(reversed(scan_includes(file)))
+    while stack:
+        dep = stack.pop()
+        if dep in seen:
+            continue
+        seen.add(dep)
+        deps.append(dep)
+        stack.extend(reversed(scan_includes(dep)))
+    return deps
+
+
+# Matches a file name in a make rule, where spaces and other special characters within the name are escaped with a backslash
+DEPENDENCY_TOKEN_REGEX = re.compile(rb"(?:\\.|[^\s\\])+")
+
+
+def unescape_dependency(token: bytes) -> str:
+    """
+    Undoes the escaping the compiler applies to file names in make rules
+    """
+    if b"\\" in token or b"$$" in token:
+        token = token.replace(b"\\ ", b" ").replace(b"\\#", b"#").replace(b"$$", b"$")
+    return os.fsdecode(token)
+
+
+def parse_dependency_rules(data: bytes) -> List[Tuple[str, List[Path]]]:
+    """
+    Parses make rules as written by -MM or -MMD. Each rule is returned as its first prerequisite, which is the source, and the
+    headers with HEADER_EXT among its prerequisites
+    """
+    rules = []
+    # Each rule has the form "object: source dep1 dep2 \" and may be continued on following lines
+    for rule in data.replace(b"\\\n", b" ").splitlines():
+        prerequisites = DEPENDENCY_TOKEN_REGEX.findall(rule.partition(b":")[2])
+        if prerequisites:
+            rules.append((unescape_dependency(prerequisites[0]),
+                          [Path(unescape_dependency(dep)) for dep in prerequisites[1:] if dep.endswith(Config.HEADER_SUFFIX)]))
+    return rules
+
+
+def dependency_file_path(source: Path) -> str:
+    """
+    Produces the path of the dependency file the compiler writes next to the object of a source
+    """
+    return source_to_object_str(str(source)) + ".d"
+
+
+def read_dependency_file(source: Path, check_mtimes: bool = True) -> Optional[List[Path]]:
+    """
+    Returns the dependencies of a source from the dependency file written when its object was last compiled, or None if there
+    isn't one. Unless check_mtimes is False, None is also returned if the source or any of its dependencies changed after the file
+    was written.
+    """
+    depfile = dependency_file_path(source)
+    if check_mtimes:
+        depfile_mtime = file_mtime(depfile)
+        source_mtime = file_mtime(source)
+        if depfile_mtime is None or source_mtime is None or source_mtime > depfile_mtime:
+            return None
+
+    try:
+        with open(depfile, 'rb') as dependency_file:
+            rules = parse_dependency_rules(dependency_file.read())
+    except OSError:
+        return None
+
+    for (rule_source, deps) in rules:
+        if rule_source == str(source):
+            if check_mtimes:
+                for dep in deps:
+                    dep_mtime = file_mtime(dep)
+                    if dep_mtime is None or dep_mtime > depfile_mtime:
+                        return None
+            return deps
+    return None
+
+
+def record_compiled_dependencies(source: Path) -> None:
+    """
+    Replaces the cached dependencies of a source with the ones the compiler found while compiling it. Those were found with the
+    full compiler flags, so they're used in place of the -MM results for the next build
+    """
+    if (deps := read_dependency_file(source, check_mtimes=False)) is not None:
+        _dependency_cache[str(source)] = dependency_cache_entry(source, deps)
+
+
+def generate_all_dependencies(files: List[Path]) -> Dict[Path, List[Path]]:
+    """
+    Generates the non-system dependencies of several source files at once. Files whose dependencies aren't cached are passed to
+    -MM commands together, which output one make rule per file, so only a few compiler processes are started.
+    """
+    all_deps: Dict[Path, List[Path]] = {}
+    uncached_files: Dict[str, Path] = {}
+
+    def _record(file: Path, deps: List[Path]):
+        all_deps[file] = deps
+        _dependency_cache[str(file)] = dependency_cache_entry(file, deps)
+
+    for file in files:
+        if (deps := cached_dependencies(file)) is not None:
+            all_deps[file] = deps
+        elif not test_source_self(str(file)) and (deps := read_dependency_file(file)) is not None:
+            # The compiler's own dependency file is only trusted for sources that aren't about to be compiled, since compiling
+            # rewrites it
+            _record(file, deps)
+        else:
+            uncached_files[str(file)] = file
+
+    if not uncached_files:
+        return all_deps
+
+    if Config.SCAN_INCLUDES:
+        # Only headers with HEADER_EXT are kept, matching what's taken from -MM output
+        header_suffix = "." + Config.HEADER_EXT
+        for name, file in uncached_files.items():
+            _record(file, [Path(dep) for dep in scan_dependencies(name) if dep.endswith(header_suffix)])
+        return all_deps
+
+    # Large batches are split across several compiler processes so they can run at once. Each process is given a few files at
+    # least, since starting the compiler costs more than scanning a single file.
+    names = list(uncached_files)
+    chunk_count = max(1, min(Config.JOBS, len(names) // 4))
+
+    def _scan(index: int, chunk: List[str]) -> bytes:
+        # Errors are discarded. A file which fails to scan produces no rule and is marked as unscanned below, so it's built and
+        # reports its error then
+        response_path = os.path.join(Config.OBJECT_DIR, f"deps{index}.rsp")
+        try:
+            return run([*Config.DEPENDENCY_ARGV, *response_file_args(chunk, response_path)], stderr=subprocess.DEVNULL).stdout
+        finally:
+            remove_response_file(response_path)
+
+    if chunk_count == 1:
+        outputs = [_scan(0, names)]
+    else:
+        with ThreadPoolExecutor(max_workers=chunk_count) as executor:
+            outputs = list(executor.map(_scan, range(chunk_count), [names[i::chunk_count] for i in range(chunk_count)]))
+
+    for output in outputs:
+        for (source, deps) in parse_dependency_rules(output):
+            if source in uncached_files:
+                _record(uncached_files[source], deps)
+
+    # Stale entries of sources that failed to scan are dropped, so nothing reads them as the source's dependencies
+    for name, file in uncached_files.items():
+        if file not in all_deps:
+            all_deps[file] = []
+            _unscanned_sources.add(name)
+            _dependency_cache.pop(name, None)
+    return all_deps
+
+
+# Name of the static archive within the object directory that objects are collected into when ARCHIVE is enabled
+ARCHIVE_FILE = "objects.a"
+
+
+def is_main_object(object_path: str) -> bool:
+    """
+    Checks whether an object was compiled from a source matching SOURCE_MAIN
+    """
+    stem = _strip_dir_prefix(object_path, Config.OBJECT_PREFIX)
+    return stem is not None and fnmatch.fnmatchcase(stem, os.path.splitext(Config.SOURCE_MAIN)[0])
 
 
-def generate_dependencies(file: Path) -> Generator[Path, None, None]:
+def update_archive(object_paths: List[str]) -> Tuple[Optional[subprocess.CompletedProcess], List[str]]:
     """
-    Generates a list of non-system dependencies to a source file using -MM
+    Collects every object except the main ones into a static archive, and returns the result of running ar (None if the archive
+    was already up to date) along with the files to link. Only objects newer than the archive are replaced in it, unless the set
+    of objects has changed since it was made, in which case it's made again so removed objects don't linger in it. Archives store
+    objects by file name, so if two objects share a name, nothing is archived and every object is linked directly.
+    """
+    main_objects = [object_path for object_path in object_paths if is_main_object(object_path)]
+    archived_objects = [object_path for object_path in object_paths if not is_main_object(object_path)]
+    if len({os.path.basename(object_path) for object_path in archived_objects}) != len(archived_objects):
+        colour_print("Some objects share a file name, so they can't be archived. Linking them directly", colour=Colours.YLW)
+        return None, object_paths
+
+    archive_path = str(Path(Config.OBJECT_DIR).joinpath(ARCHIVE_FILE))
+    members_path = archive_path + ".members"
+    try:
+        with open(members_path, 'r') as members_file:
+            previous_members = members_file.read().splitlines()
+        archive_mtime = os.stat(archive_path).st_mtime_ns
+    except OSError:
+        previous_members = None
+
+    # Objects compiled during this build have out of date cached stats, so they're checked directly
+    if previous_members == archived_objects:
+        changed_objects = [object_path for object_path in archived_objects if os.stat(object_path).st_mtime_ns > archive_mtime]
+    else:
+        changed_objects = archived_objects
+        try:
+            os.remove(archive_path)
+        except FileNotFoundError:
+            pass
+
+    ret = None
+    if changed_objects:
+        response_path = archive_path + ".rsp"
+        argv = ["ar", "rcs", archive_path, *response_file_args(changed_objects, response_path)]
+        colour_print("Running: ", colour=Colours.CYN, style=Styles.BLD, end='')
+        colour_print(shlex.join(argv), colour=Colours.WHT)
+        try:
+            ret = run(argv)
+        finally:
+            remove_response_file(response_path)
+        if ret.returncode == 0:
+            with open(members_path, 'w') as members_file:
+                members_file.write("\n".join(archived_objects))
+
+    return ret, [*main_objects, archive_path] if archived_objects else main_objects
+
+
+# Name of the ninja file written to the object directory when BACKEND is ninja
+NINJA_FILE = "build.ninja"
+
+
+def ninja_escape(path: str) -> str:
     """
+    Escapes a path for use in the build statements of a ninja file
+    """
+    return path.replace("$", "$$").replace(" ", "$ ").replace(":", "$:")
+
+
+def ninja_command_escape(command: str) -> str:
+    """
+    Escapes a command for use in a rule of a ninja file, where only $ is special. Spaces and colons are left for the shell
+    """
+    return command.replace("$", "$$")
+
+
+def emit_ninja(sources: List[Path]) -> str:
+    """
+    Writes a ninja file which compiles the given sources and links them into the executable, and returns its path. Header
+    dependencies are left to ninja, which reads the depfile the compiler writes with -MMD. The file is only rewritten when its
+    contents change.
+    """
+    object_paths = [source_to_object_str(str(source)) for source in sources]
+    exe_full_path = str(Path(Config.EXE_DIR).joinpath(Config.EXE_FILE))
+
+    lines = [
+        "# Generated by make.py, changes will be overwritten",
+        # Keeps ninja's log and dependency database in the object directory, so cleaning removes them too
+        f"builddir = {ninja_escape(Config.OBJECT_DIR)}",
+        "rule cxx",
+        f"  command = {ninja_command_escape(shlex.join(Config.COMPILE_ARGV))} -MF $out.d $in -o $out",
+        "  depfile = $out.d",
+        "  deps = gcc",
+        "  description = Compiling $in",
+        "rule link",
+        f"  command = {ninja_command_escape(shlex.join(Config.LINK_ARGV))} -o $out $in",
+        "  description = Linking $out",
+    ]
+    for source, object_path in zip(sources, object_paths):
+        lines.append(f"build {ninja_escape(object_path)}: cxx {ninja_escape(str(source))}")
+
+    if Config.SKIP_LINKER:
+        lines.append(f"default {' '.join(ninja_escape(object_path) for object_path in object_paths)}")
+    else:
+        lines.append(f"build {ninja_escape(exe_full_path)}: link {' '.join(ninja_escape(object_path) for object_path in object_paths)}")
+        lines.append(f"default {ninja_escape(exe_full_path)}")
+    contents = "\n".join(lines) + "\n"
 
-    # This will create a string of all the non-system dependencies for our source file separated by spaces
-    cmd = f"{Config.COMPILER} {Config.OTHER_INCLUDE_PATHS} -MM -I{Config.HEADER_DIR} {file}"
-    deps = re.findall(r"\S+\.hpp", str(shell(cmd).stdout.decode(sys.stdout.encoding)))
+    ninja_path = str(Path(Config.OBJECT_DIR).joinpath(NINJA_FILE))
+    try:
+        with open(ninja_path, 'r') as ninja_file:
+            if ninja_file.read() == contents:
+                return ninja_path
+    except OSError:
+        pass
 
-    return (Path(dep) for dep in deps)
+    Path(Config.OBJECT_DIR).mkdir(parents=True, exist_ok=True)
+    with open(ninja_path, 'w') as ninja_file:
+        ninja_file.write(contents)
+    return ninja_path
+
+
+def build_ninja():
+    """
+    Builds by discovering the sources as usual, then handing compiling and linking to ninja
+    """
+    unsupported = [name for (name, enabled) in (("ARCHIVE", Config.ARCHIVE), ("HASH_CHECK", Config.HASH_CHECK)) if enabled]
+    if unsupported:
+        colour_print(f"{' and '.join(unsupported)} not supported by the ninja backend, ignoring", colour=Colours.YLW)
+
+    load_dependency_cache()
+    sources = source_files()
+    save_dependency_cache()
+
+    ninja_path = emit_ninja([source for (source, _, _) in sources])
+    argv = ["ninja", "-f", ninja_path, "-j", str(Config.JOBS)]
+    colour_print("Running: ", colour=Colours.CYN, style=Styles.BLD, end='')
+    colour_print(shlex.join(argv), colour=Colours.WHT)
+
+    # Ninja prints its own progress and buffers each command's output, so its output is passed through line by line. It only keeps
+    # colours for terminals, so it's told to keep them when the output is going to one
+    sys.stdout.flush()
+    env = {**os.environ, **Config.COMPILE_ENV, **({"CLICOLOR_FORCE": "1"} if USE_COLOUR else {})}
+    no_work = False
+    with subprocess.Popen(argv, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, env=env) as process:
+        for line in process.stdout:
+            sys.stdout.write(indent_output(line))
+            no_work = no_work or line.startswith(b"ninja: no work to do")
+    print()
+
+    if process.returncode != 0:
+        colour_print("Building failed!", colour=Colours.RED, style=Styles.BLD)
+        colour_print("----------------", colour=Colours.RED)
+        return
+
+    if Config.COMPILATION_DATABASE:
+        colour_print("Writing compilation database to compile_commands.json...", colour=Colours.WHT)
+        with open('compile_commands.json', 'wb') as output_file:
+            subprocess.run(["ninja", "-f", ninja_path, "-t", "compdb", "cxx"], stdout=output_file)
+
+    if no_work:
+        colour_print("Everything up to date!", colour=Colours.GRN, style=Styles.BLD)
+        colour_print("----------------------", colour=Colours.GRN)
+    else:
+        colour_print("Compilation succeeded", colour=Colours.BLU, style=Styles.BLD)
+        colour_print("---------------------", colour=Colours.BLU)
+    update_resources()
 
 
 def build():
@@ -295,18 +1391,106 @@ def build():
     linking_required = False
     compiled_with_warnings = False
     check_resources = False
-
-    for (source, needs_building) in source_files():
-        if needs_building:
-            (compiled, has_warnings) = build_object(source)
+    build_succeeded = False
+
+    # Files may have changed since the last build in this process
+    _file_stat.cache_clear()
+    scan_includes.cache_clear()
+    file_digest.cache_clear()
+    directive_digest.cache_clear()
+    _unscanned_sources.clear()
+    # Dependencies and content hashes are loaded again from the object directory when they're needed, so nothing from an earlier
+    # build in this process, such as one started by watch, carries over
+    _dependency_cache.clear()
+    _build_hashes.clear()
+    # The configuration may have changed since the last build in this process
+    header_to_source_str.cache_clear()
+    source_to_object_str.cache_clear()
+    # Content hashes aren't recorded for files modified after this, since an object may have been compiled before the change
+    build_started = time.time_ns()
+
+    if Config.BACKEND == "ninja":
+        if shutil.which("ninja") is not None:
+            build_ninja()
+            return
+        colour_print("BACKEND is ninja, but ninja wasn't found. Building without it", colour=Colours.YLW, style=Styles.BLD)
+
+    outdated_sources: List[Tuple[Path, int]] = []
+    missing_sources: Set[Path] = set()
+
+    # Object folders are created from the main thread before their jobs are submitted, once per folder
+    object_dirs: Set[str] = set()
+
+    def _make_object_dir(source: Path):
+        object_dir = os.path.dirname(source_to_object_str(str(source)))
+        if object_dir not in object_dirs:
+            object_dirs.add(object_dir)
+            os.makedirs(object_dir or ".", exist_ok=True)
+
+    # Each object is compiled by an independent compiler process, so they can all run at once. Output from each job is buffered
+    # and printed as the job completes to keep messages from different compilers from interleaving.
+    with ThreadPoolExecutor(max_workers=Config.JOBS) as executor:
+        futures: Dict[Any, Path] = {}
+
+        # If nothing has changed since the last successful build, there's no need to scan for dependencies at all
+        manifest_objects = manifest_up_to_date()
+        if manifest_objects is not None:
+            sources = []
+            object_paths = manifest_objects
+            sys.stdout.write("".join(f"{SKIP_PREFIX}{object_path}{LINE_END}" for object_path in object_paths))
+        else:
+            remove_manifest()
+            load_dependency_cache()
+            if Config.HASH_CHECK:
+                load_build_hashes()
+            # Sources newer than their objects start compiling while the rest of the dependencies are still being generated
+            started_sources: Set[Path] = set()
+
+            def _start_early(source: Path):
+                started_sources.add(source)
+                _make_object_dir(source)
+                futures[executor.submit(build_object, source)] = source
+
+            sources = source_files(missing_sources, _start_early)
+            save_dependency_cache()
+
+            # Object paths are computed once here and reused for the link command
+            object_paths = [source_to_object_str(str(source)) for (source, _, _) in sources]
+
+            skipped_lines = []
+            for (source, needs_building, dependents), object_path in zip(sources, object_paths):
+                if not needs_building:
+                    skipped_lines.append(f"{SKIP_PREFIX}{object_path}{LINE_END}")
+                elif source not in started_sources:
+                    outdated_sources.append((source, dependents))
+            sys.stdout.write("".join(skipped_lines))
+
+        # Start the most depended-on and largest sources first, since they are the most likely to hold up the end of the build
+        outdated_sources.sort(key=lambda job: (job[1], file_stat(job[0]).st_size), reverse=True)
+
+        for (source, _) in outdated_sources:
+            _make_object_dir(source)
+        futures.update((executor.submit(build_object, source), source) for (source, _) in outdated_sources)
+        for future in as_completed(futures):
+            (compiled, has_warnings, output) = future.result()
+            print(output, end='')
             if compiled:
                 linking_required = True
                 compiled_with_warnings = compiled_with_warnings or has_warnings
+                record_compiled_dependencies(futures[future])
+                if Config.HASH_CHECK:
+                    record_content(futures[future], build_started)
             else:
                 object_building_success = False
+                for pending in futures:
+                    pending.cancel()
                 break
-        else:
-            colour_print(f"Skipping (up to date):                {source_to_object(source)}", colour=Colours.GRN)
+
+    # Dependencies and hashes are saved even if building failed, since they're correct for every object that was built
+    if linking_required:
+        save_dependency_cache()
+    if Config.HASH_CHECK and manifest_objects is None:
+        save_build_hashes()
 
     # if we've built any new files
     if Config.COMPILATION_DATABASE and linking_required:
@@ -320,24 +1504,35 @@ def build():
     else:
         print("")
         exe_full_path = Path(Config.EXE_DIR).joinpath(Config.EXE_FILE)
-        if not linking_required and not os.path.exists(exe_full_path):
-            linking_required = True
-            # colour_print(f"The file {exe_full_path} doesn't exist.", colour=colours.MGT, style=styles.BLD)
+        if not linking_required:
+            # Nothing was compiled, so the cached stats are current. The executable needs linking if it doesn't exist or any object
+            # is newer than it, such as an object rebuilt by an interrupted build that never reached the link step
+            exe_mtime = file_mtime(exe_full_path)
+            object_mtimes = [file_mtime(object_path) for object_path in object_paths]
+            if exe_mtime is None or None in object_mtimes or exe_mtime < max(object_mtimes, default=exe_mtime):
+                linking_required = True
 
         if linking_required and not Config.SKIP_LINKER:
             # Build exe location folders
             Path(Path(Config.EXE_DIR)).mkdir(parents=True, exist_ok=True)
 
-            cmd = f"{Config.COMPILER} {Config.OTHER_LIB_PATHS} {Config.LINKER_FLAGS} -o {exe_full_path} {' '.join((str(source_to_object(s)) for (s, b) in source_files()))}"
-
             colour_print("Generating executable... ", colour=Colours.CYN, style=Styles.BLD)
-            colour_print("Running: ", colour=Colours.CYN, style=Styles.BLD, end='')
-            colour_print(cmd, colour=Colours.WHT)
 
-            ret = shell(cmd)
-            if msg_lines := ret.stdout.decode(sys.stdout.encoding).splitlines():
-                for line in msg_lines:
-                    print(f"\t{line}")
+            link_inputs = object_paths
+            ret = None
+            if Config.ARCHIVE:
+                (ret, link_inputs) = update_archive(object_paths)
+
+            if ret is None or ret.returncode == 0:
+                response_path = os.path.join(Config.OBJECT_DIR, "link.rsp")
+                argv = [*Config.LINK_ARGV, "-o", str(exe_full_path), *response_file_args(link_inputs, response_path)]
+                colour_print("Running: ", colour=Colours.CYN, style=Styles.BLD, end='')
+                colour_print(shlex.join(argv), colour=Colours.WHT)
+                try:
+                    ret = run(argv)
+                finally:
+                    remove_response_file(response_path)
+            sys.stdout.write(indent_output(ret.stdout))
             print()
 
             if ret.returncode != 0:
@@ -352,7 +1547,9 @@ def build():
                     colour_print("---------------------", colour=Colours.BLU)
 
                 check_resources = True
+                build_succeeded = True
         else:
+            build_succeeded = True
             if Config.SKIP_LINKER:
                 colour_print("\nConfig.SKIP_LINKER is set", colour=Colours.GRN, style=Styles.BLD)
                 colour_print("Skipping executable generation", colour=Colours.GRN, style=Styles.BLD)
@@ -365,96 +1562,210 @@ def build():
 
                 check_resources = True
 
-    if check_resources and Config.RESOURCES:
-        colour_print("")
-        colour_print("Updating resource files ", colour=Colours.WHT, style=Styles.BLD)
-        for in_file, out_folder in Config.RESOURCES.items():
-            colour_print(f"Checking {in_file}...", colour=Colours.WHT)
-            for matched_file in Path(".").glob(str(in_file)):
-                copy_if_outdated(matched_file, Path(Config.EXE_DIR).joinpath(out_folder, matched_file.name))
+    if build_succeeded and manifest_objects is None:
+        save_manifest([source for (source, _, _) in sources], object_paths, missing_sources)
+
+    if check_resources:
+        update_resources()
 
 
-def build_object(source_file: Path) -> Tuple[bool, bool]:
+def update_resources():
     """
-    Compiles the given source file and directs it to the given object file location.
-    If the path for the object file doesn't exist, a new directory structure will be created for it.
+    Copies resource files that are missing or out of date into the executable directory
     """
+    if not Config.RESOURCES:
+        return
 
-    object_file = source_to_object(source_file)
+    colour_print("")
+    colour_print("Updating resource files ", colour=Colours.WHT, style=Styles.BLD)
+    copies: List[Tuple[str, str, int]] = []
+    previous_snapshot = load_resource_snapshot()
+    snapshot: Dict[str, Dict[str, Optional[int]]] = {}
+    seen_paths: Dict[str, Set[str]] = {}
+    for in_file, out_folder in Config.RESOURCES.items():
+        colour_print(f"Checking {in_file}...", colour=Colours.WHT)
+        out_path = Path(Config.EXE_DIR).joinpath(out_folder)
+        key = f"{in_file} -> {out_path}"
+
+        # Entries whose files haven't changed since the last update don't need to be matched or compared again
+        if resource_snapshot_matches(previous_snapshot.get(key)):
+            snapshot[key] = previous_snapshot[key]
+            continue
+
+        seen: Set[str] = set()
+        for matched_file in match_paths(in_file):
+            find_outdated_copies(matched_file, out_path.joinpath(matched_file.name), copies, seen=seen)
 
-    # If object file dir is missing, make it
-    Path(Path(object_file).parent).mkdir(parents=True, exist_ok=True)
+        # New matches for a pattern change the mtime of the folder they're in, and a literal path is recorded even when it's
+        # missing so it's only checked again once it exists. Recursive patterns can't be covered this way and are always checked
+        if not GLOB_MAGIC_REGEX.search(str(in_file.parent)):
+            seen.add(str(in_file.parent if GLOB_MAGIC_REGEX.search(in_file.name) else in_file))
+            seen_paths[key] = seen
+
+    # Copies are independent of each other, so they're done in parallel once all outdated files are known
+    with ThreadPoolExecutor(max_workers=Config.JOBS) as executor:
+        for _ in executor.map(lambda copy: copy_file(*copy), copies):
+            pass
+
+    # Destination files were written by the copies, so their cached stats are out of date
+    _file_stat.cache_clear()
+    for key, seen in seen_paths.items():
+        snapshot[key] = {path: file_mtime(path) for path in seen}
+    save_resource_snapshot(snapshot)
+
+
+# Seconds between checks for changed files while watching
+WATCH_INTERVAL = 0.5
+
+
+def watched_paths() -> Set[str]:
+    """
+    Returns every path the last build depended on: the folder of SOURCE_MAIN, each source found, and each of their headers. The
+    sources each header would bring into the build are included whether or not they exist yet, so adding one triggers a rebuild
+    """
+    load_dependency_cache()
+    paths = {str(Path(Config.SOURCE_DIR).joinpath(Config.SOURCE_MAIN).parent)}
+    for source, entry in _dependency_cache.items():
+        paths.add(source)
+        paths.update(entry["deps"])
+    for dep in {dep for entry in _dependency_cache.values() for dep in entry["deps"]}:
+        if (mapped_sources := Config.DEPEND_MAPPING.get(Path(dep))) is not None:
+            paths.update(str(mapped_source) for mapped_source in mapped_sources)
+        elif (candidate := header_to_source_str(str(Path(dep)))) is not None:
+            paths.add(candidate)
+    return paths
+
+
+def current_mtimes(paths: Set[str]) -> Dict[str, Optional[int]]:
+    """
+    Returns the current mtime of each path, bypassing the stat cache
+    """
+    _file_stat.cache_clear()
+    return {path: file_mtime(path) for path in paths}
+
+
+def watch():
+    """
+    Builds, then rebuilds in the same process whenever a file the build depends on changes, until interrupted. Files are polled
+    rather than watched with OS notifications, so no extra packages are needed. A build that raises an error is reported, and
+    watching carries on.
+    """
+    try:
+        while True:
+            try:
+                build()
+            except Exception as error:
+                colour_print(f"\nBuild stopped by an error: {error!r}", colour=Colours.RED, style=Styles.BLD)
+            paths = watched_paths()
+            snapshot = current_mtimes(paths)
+            colour_print("\nWatching for changes... (Ctrl+C to stop)", colour=Colours.WHT, style=Styles.BLD)
+            while True:
+                time.sleep(WATCH_INTERVAL)
+                if current_mtimes(paths) != snapshot:
+                    break
+            colour_print("\nChanges found, rebuilding", colour=Colours.WHT, style=Styles.BLD)
+    except KeyboardInterrupt:
+        colour_print("\nStopped watching", colour=Colours.WHT, style=Styles.BLD)
+
+
+def build_object(source_file: Path) -> Tuple[bool, bool, str]:
+    """
+    Compiles the given source file and directs it to the given object file location. The folder of the object file must already
+    exist.
+    Returns whether compilation succeeded, whether the compiler produced any messages, and the output of the job.
+    """
+
+    object_file = source_to_object(source_file)
 
     compile_command_path = Path(Config.OBJECT_DIR).joinpath(f"{'-'.join(source_file.parts)}.json")
-    compile_command = f"-MJ {compile_command_path}" if Config.COMPILATION_DATABASE else ""
+    compile_command = ["-MJ", str(compile_command_path)] if Config.COMPILATION_DATABASE else []
 
-    cmd = f"{Config.COMPILER} -fdiagnostics-color=always {Config.COMPILER_FLAGS} {compile_command} -c -I{Config.HEADER_DIR} {Config.OTHER_INCLUDE_PATHS} {source_file} -o {object_file}"
-    colour_print("Running: ", style=Styles.BLD, end='')
-    colour_print(cmd)
+    argv = [*Config.COMPILE_ARGV, *compile_command, "-MF", dependency_file_path(source_file), str(source_file),
+            "-o", str(object_file)]
+    output = io.StringIO()
+    colour_print("Running: ", style=Styles.BLD, end='', file=output)
+    colour_print(shlex.join(argv), file=output)
 
-    ret = shell(cmd)
+    ret = run(argv, env=Config.COMPILE_ENV)
 
-    if msg_lines := ret.stdout.decode(sys.stdout.encoding).splitlines():
-        for line in msg_lines:
-            print(f"\t{line}")
-        print()
-        return ret.returncode == 0, True
+    if messages := indent_output(ret.stdout):
+        output.write(messages)
+        print(file=output)
+        return ret.returncode == 0, True, output.getvalue()
     else:
-        return ret.returncode == 0, False
+        return ret.returncode == 0, False, output.getvalue()
 
 
-def execute(action: str):
+def print_configuration():
     """
-    Executes build based on configuration
+    Prints the configuration for this build. It's collected into a buffer and written in one go, rather than a write per line
     """
-
-    print("")
-    colour_print("Configuration", style=Styles.ALL)
-    colour_print("    EXE directory:    ", colour=Colours.YLW, style=Styles.BLD, end='')
-    colour_print(Config.EXE_DIR, colour=Colours.YLW)
-    colour_print("    EXE file:         ", colour=Colours.YLW, style=Styles.BLD, end='')
-    colour_print(Config.EXE_FILE, colour=Colours.YLW)
-
-    colour_print("    Source main file: ", colour=Colours.GRN, style=Styles.BLD, end='')
-    colour_print(Config.SOURCE_MAIN, colour=Colours.GRN)
-    colour_print("    Source directory: ", colour=Colours.GRN, style=Styles.BLD, end='')
-    colour_print(Config.SOURCE_DIR, colour=Colours.GRN)
-    colour_print("    Source extension: ", colour=Colours.GRN, style=Styles.BLD, end='')
-    colour_print(Config.SOURCE_EXT, colour=Colours.GRN)
-
-    colour_print("    Header directory: ", colour=Colours.CYN, style=Styles.BLD, end='')
-    colour_print(Config.HEADER_DIR, colour=Colours.CYN)
-    colour_print("    Header extension: ", colour=Colours.CYN, style=Styles.BLD, end='')
-    colour_print(Config.HEADER_EXT, colour=Colours.CYN)
-
-    colour_print("    Object directory: ", colour=Colours.BLU, style=Styles.BLD, end='')
-    colour_print(Config.OBJECT_DIR, colour=Colours.BLU)
-    colour_print("    Object extension: ", colour=Colours.BLU, style=Styles.BLD, end='')
-    colour_print(Config.OBJECT_EXT, colour=Colours.BLU)
-
-    colour_print("    Other includes:   ", colour=Colours.MGT, style=Styles.BLD, end='')
-    colour_print(Config.OTHER_INCLUDE_PATHS, colour=Colours.MGT)
-
-    colour_print("    Header mappings:  ", colour=Colours.MGT, style=Styles.BLD)
+    output = io.StringIO()
+
+    print("", file=output)
+    colour_print("Configuration", style=Styles.ALL, file=output)
+    colour_print("    EXE directory:    ", colour=Colours.YLW, style=Styles.BLD, end='', file=output)
+    colour_print(Config.EXE_DIR, colour=Colours.YLW, file=output)
+    colour_print("    EXE file:         ", colour=Colours.YLW, style=Styles.BLD, end='', file=output)
+    colour_print(Config.EXE_FILE, colour=Colours.YLW, file=output)
+
+    colour_print("    Source main file: ", colour=Colours.GRN, style=Styles.BLD, end='', file=output)
+    colour_print(Config.SOURCE_MAIN, colour=Colours.GRN, file=output)
+    colour_print("    Source directory: ", colour=Colours.GRN, style=Styles.BLD, end='', file=output)
+    colour_print(Config.SOURCE_DIR, colour=Colours.GRN, file=output)
+    colour_print("    Source extension: ", colour=Colours.GRN, style=Styles.BLD, end='', file=output)
+    colour_print(Config.SOURCE_EXT, colour=Colours.GRN, file=output)
+
+    colour_print("    Header directory: ", colour=Colours.CYN, style=Styles.BLD, end='', file=output)
+    colour_print(Config.HEADER_DIR, colour=Colours.CYN, file=output)
+    colour_print("    Header extension: ", colour=Colours.CYN, style=Styles.BLD, end='', file=output)
+    colour_print(Config.HEADER_EXT, colour=Colours.CYN, file=output)
+
+    colour_print("    Object directory: ", colour=Colours.BLU, style=Styles.BLD, end='', file=output)
+    colour_print(Config.OBJECT_DIR, colour=Colours.BLU, file=output)
+    colour_print("    Object extension: ", colour=Colours.BLU, style=Styles.BLD, end='', file=output)
+    colour_print(Config.OBJECT_EXT, colour=Colours.BLU, file=output)
+
+    colour_print("    Other includes:   ", colour=Colours.MGT, style=Styles.BLD, end='', file=output)
+    colour_print(" ".join(Config.OTHER_INCLUDE_PATHS), colour=Colours.MGT, file=output)
+
+    colour_print("    Header mappings:  ", colour=Colours.MGT, style=Styles.BLD, file=output)
     for header, source_list in Config.DEPEND_MAPPING.items():
-        colour_print(f"        {header} -> ", colour=Colours.MGT, end='')
+        colour_print(f"        {header} -> ", colour=Colours.MGT, end='', file=output)
         space_padding = len(f"        {str(header)} -> ")
         for i, source in enumerate(source_list):
             if i == 0:
-                colour_print(f"{str(source)}", colour=Colours.MGT)
+                colour_print(f"{str(source)}", colour=Colours.MGT, file=output)
             else:
-                colour_print(f"{' '*space_padding}{str(source)}", colour=Colours.MGT)
+                colour_print(f"{' '*space_padding}{str(source)}", colour=Colours.MGT, file=output)
+
+    colour_print("    Compiler:         ", colour=Colours.RED, style=Styles.BLD, end='', file=output)
+    colour_print(Config.COMPILER, colour=Colours.RED, file=output)
+    colour_print("    Launcher:         ", colour=Colours.RED, style=Styles.BLD, end='', file=output)
+    colour_print(shlex.join(Config.COMPILE_LAUNCHER) or "none", colour=Colours.RED, file=output)
+    colour_print("    Compiler flags:   ", colour=Colours.RED, style=Styles.BLD, end='', file=output)
+    colour_print(Config.COMPILER_FLAGS, colour=Colours.RED, file=output)
+    colour_print("    Linker flags:     ", colour=Colours.RED, style=Styles.BLD, end='', file=output)
+    colour_print(Config.LINKER_FLAGS, colour=Colours.RED, file=output)
+    colour_print("    Linker:           ", colour=Colours.RED, style=Styles.BLD, end='', file=output)
+    colour_print(Config.FAST_LINKER or "default", colour=Colours.RED, file=output)
+    colour_print("    Jobs:             ", colour=Colours.RED, style=Styles.BLD, end='', file=output)
+    colour_print(str(Config.JOBS), colour=Colours.RED, file=output)
+
+    colour_print("    Resources:        ", colour=Colours.YLW, style=Styles.BLD, file=output)
+    for s in (f"        {in_file} -> {Path(Config.EXE_DIR).joinpath(out_file)}" for in_file, out_file in Config.RESOURCES.items()):
+        colour_print(s, colour=Colours.YLW, file=output)
 
-    colour_print("    Compiler:         ", colour=Colours.RED, style=Styles.BLD, end='')
-    colour_print(Config.COMPILER, colour=Colours.RED)
-    colour_print("    Compiler flags:   ", colour=Colours.RED, style=Styles.BLD, end='')
-    colour_print(Config.COMPILER_FLAGS, colour=Colours.RED)
-    colour_print("    Linker flags:     ", colour=Colours.RED, style=Styles.BLD, end='')
-    colour_print(Config.LINKER_FLAGS, colour=Colours.RED)
+    sys.stdout.write(output.getvalue())
+    sys.stdout.flush()
 
-    colour_print("    Resources:        ", colour=Colours.YLW, style=Styles.BLD)
-    for s in (f"        {in_file} -> {Path(Config.EXE_DIR).joinpath(out_file)}" for in_file, out_file in Config.RESOURCES.items()):
-        colour_print(s, colour=Colours.YLW)
+
+def execute(action: str):
+    """
+    Executes build based on configuration
+    """
+
+    print_configuration()
 
     colour_print("")
     colour_print("Running target ", colour=Colours.WHT, end='')
@@ -463,14 +1774,22 @@ def execute(action: str):
     if action == "build":
         build()
 
+    elif action == "watch":
+        watch()
+
     elif action == "clean":
         exe_full_path = Path(Config.EXE_DIR).joinpath(Config.EXE_FILE)
-        if os.path.exists(Config.OBJECT_DIR):
+        # Removal is attempted directly, and a missing file or folder just means there's nothing to clean
+        try:
+            discard_tree(Config.OBJECT_DIR)
             colour_print("Removing " + Config.OBJECT_DIR + "...", colour=Colours.MGT)
-            shutil.rmtree(Config.OBJECT_DIR)
-        if os.path.exists(exe_full_path):
-            colour_print(f"Removing {exe_full_path}...", colour=Colours.MGT)
+        except FileNotFoundError:
+            pass
+        try:
             os.remove(exe_full_path)
+            colour_print(f"Removing {exe_full_path}...", colour=Colours.MGT)
+        except FileNotFoundError:
+            pass
 
     print("")
 
@@ -481,7 +1800,7 @@ def parse_config(file):
     """
     colour_print("Constructing configuration from file ", end='')
     # colour_print(args.config, style=styles.BLD)
-    config_file = yaml.safe_load(file.read())
+    config_file = yaml.load(file, Loader=YamlLoader)
     Config.construct(config_file)
 
 
@@ -495,28 +1814,55 @@ def parse_dict(configuration: Dict[str, str]):
     Config.construct(configuration)
 
 
+def positive_int(value: str) -> int:
+    """
+    Argparse type for arguments that must be a whole number of at least 1
+    """
+    try:
+        number = int(value)
+    except ValueError:
+        number = 0
+    if number < 1:
+        raise argparse.ArgumentTypeError(f"must be a whole number of at least 1, got '{value}'")
+    return number
+
+
 def main():
     """
     Main entry point when running this file as a script. Argparse expects two parameters:
         --target
-            Operation to perform, currently supports build or clean.
+            Operation to perform, currently supports build, clean or watch. Watch rebuilds whenever a source or header changes.
         --config
             YAML file containing build configurations for this run. This is required for cleaning or building, since the configuration
             stores the paths for the object files and bin folder which will be deleted on cleaning.
+    Optionally takes:
+        --jobs, -j
+            Maximum number of objects to compile at once. Overrides JOBS in the config.
+        --backend
+            Builds with make.py itself (python) or through ninja. Overrides BACKEND in the config.
     """
 
     arg_parser = argparse.ArgumentParser()
-    arg_parser.add_argument("--target", required=True, choices=['build', 'clean'])
+    arg_parser.add_argument("--target", required=True, choices=['build', 'clean', 'watch'])
     arg_parser.add_argument("--config", required=True, type=str)
+    arg_parser.add_argument("--jobs", "-j", type=positive_int, help="Maximum number of objects to compile at once (defaults to CPU count)")
+    arg_parser.add_argument("--backend", choices=['python', 'ninja'], help="Builds with make.py itself or through ninja")
     args = arg_parser.parse_args(args=sys.argv[1:])
 
-    if not os.path.exists(args.config):
+    try:
+        f = open(args.config)
+    except FileNotFoundError:
         colour_print(f"File '{args.config}' does not exist. Aborting.", colour=Colours.RED, style=Styles.BLD, end='')
         sys.exit(1)
 
-    with open(args.config) as f:
+    with f:
         parse_config(f)
 
+    if args.jobs is not None:
+        Config.JOBS = args.jobs
+    if args.backend:
+        Config.BACKEND = args.backend
+
     execute(args.target)
 
 